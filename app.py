@@ -4,9 +4,22 @@ Flask application that provides ocean activity recommendations based on forecast
 """
 
 import os
+import math
 import random
+import hmac
+import ipaddress
+import operator
+import queue
+import secrets
+import socket
+import threading
+import time
+import uuid
 import requests
+from collections import deque
 from datetime import datetime
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
 from flask import Flask, render_template, jsonify, request
 from flask_cors import CORS
 from dotenv import load_dotenv
@@ -366,6 +379,7 @@ def get_simulated_conditions(location):
         'pressure': f"{round(pressure, 2):.2f} inHg",
         'pressureValue': round(pressure, 2),
         'location': location,
+        'measuredFields': [],
         'dataSource': 'Simulated'
     }
 
@@ -376,6 +390,7 @@ def get_ocean_conditions(location):
     Tries multiple APIs in order of preference.
     """
     conditions = {}
+    measured = set()  # fields read from an API rather than estimated
     lat = None
     lon = None
     
@@ -427,6 +442,18 @@ def get_ocean_conditions(location):
             else:
                 conditions['uvIndex'] = round(random.random() * 5)
             
+            measured.add('hasPrecipitation')
+            if 'temp' in main:
+                measured.add('temperature')
+            if 'pressure' in main:
+                measured.add('pressureValue')
+            if 'speed' in wind:
+                measured.add('windSpeed')
+            if 'deg' in wind:
+                measured.add('windDirection')
+            if 'all' in clouds:
+                measured.add('cloudValue')
+            
             conditions['dataSource'] = 'OpenWeatherMap'
         except Exception as e:
             print(f"Error parsing OpenWeatherMap data: {e}")
@@ -444,6 +471,8 @@ def get_ocean_conditions(location):
                 if 'waveHeight' in current_hour:
                     wave_height_m = current_hour['waveHeight'].get('noaa', 0)
                     conditions['waveHeight'] = round(wave_height_m * 3.281, 2)
+                    if 'noaa' in current_hour['waveHeight']:
+                        measured.add('waveHeight')
                 
                 if 'waveDirection' in current_hour:
                     wave_dir = current_hour['waveDirection'].get('noaa', 0)
@@ -456,16 +485,22 @@ def get_ocean_conditions(location):
                         if start <= wave_dir < end or (wave_dir >= 337.5 and direction == 'N'):
                             conditions['swellDirection'] = direction
                             break
+                    if 'noaa' in current_hour['waveDirection']:
+                        measured.add('swellDirection')
                 
                 if 'waterTemperature' in current_hour:
                     water_temp_c = current_hour['waterTemperature'].get('noaa', 0)
                     conditions['waterTemperature'] = round(water_temp_c * 9/5 + 32, 2)
+                    if 'noaa' in current_hour['waterTemperature']:
+                        measured.add('waterTemperature')
                 
                 if 'currentSpeed' in current_hour:
                     current_speed_ms = current_hour['currentSpeed'].get('noaa', 0)
                     current_val = round(current_speed_ms * 1.944, 2)
                     conditions['currentValue'] = current_val
                     conditions['currentStrength'] = f"{current_val:.2f} knots"
+                    if 'noaa' in current_hour['currentSpeed']:
+                        measured.add('currentValue')
                 
                 if 'waveHeight' in conditions:
                     wave_ht = conditions.get('waveHeight', 2)
@@ -542,6 +577,7 @@ def get_ocean_conditions(location):
         conditions['pressure'] = f"{pressure_val} inHg"
     
     conditions['location'] = location
+    conditions['measuredFields'] = sorted(measured)
     
     if 'dataSource' not in conditions:
         return get_simulated_conditions(location)
@@ -568,6 +604,391 @@ def evaluate_activities(conditions):
     return scored_activities
 
 
+# Subscription alerts
+# Subscriptions are indexed by (cell, field) so that a fresh conditions update
+# only re-checks the rules watching a field whose value actually changed.
+# A cell is a normalized location string.
+SUBSCRIPTION_OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le
+}
+
+# Condition fields a rule can watch. A field is only evaluated when it appears
+# in the update's measuredFields; values filled in randomly would otherwise flip
+# rules back and forth on every refresh. uvIndex and visibility are always
+# estimated, and tideValue is left out because NOAA_STATION_ID is a single
+# station that does not follow the requested location.
+SUBSCRIPTION_FIELDS = [
+    'temperature', 'windSpeed', 'cloudValue', 'pressureValue',
+    'waterTemperature', 'waveHeight', 'currentValue'
+]
+
+# Activity scores are only evaluated for alerts when every one of these inputs
+# was measured
+ACTIVITY_MEASURED_INPUTS = [
+    'temperature', 'windSpeed', 'windDirection', 'cloudValue', 'pressureValue',
+    'hasPrecipitation', 'waterTemperature', 'waveHeight', 'swellDirection', 'currentValue'
+]
+
+# Fixed stand-ins for the inputs that are never measured per location, used when
+# scoring activities for alerts. Each earns no bonus or penalty in the
+# evaluate_* functions, so alert scores only move with measured data.
+ESTIMATED_INPUT_VALUES = {
+    'visibility': 0,
+    'uvIndex': 0,
+    'tideValue': 2.0
+}
+
+ALERT_QUEUE_SIZE = int(os.getenv('ALERT_QUEUE_SIZE', 1000))
+ALERT_WEBHOOK_ALLOW_PRIVATE = os.getenv('ALERT_WEBHOOK_ALLOW_PRIVATE', 'False').lower() == 'true'
+ALERT_WEBHOOK_WORKERS = int(os.getenv('ALERT_WEBHOOK_WORKERS', 2))
+SUBSCRIPTION_REFRESH_INTERVAL = int(os.getenv('SUBSCRIPTION_REFRESH_INTERVAL', 3600))
+ALERT_COOLDOWN = int(os.getenv('ALERT_COOLDOWN', 3600))
+MAX_LOCATIONS_PER_SUBSCRIPTION = int(os.getenv('MAX_LOCATIONS_PER_SUBSCRIPTION', 10))
+MAX_SUBSCRIPTIONS = int(os.getenv('MAX_SUBSCRIPTIONS', 1000))
+MAX_SUBSCRIBED_CELLS = int(os.getenv('MAX_SUBSCRIBED_CELLS', 50))
+
+subscriptions = {}          # subscription id -> subscription
+subscription_index = {}     # (cell, field) -> set of subscription ids
+cell_subscriptions = {}     # cell -> set of subscription ids
+subscription_state = {}     # subscription id -> whether the rule currently holds
+last_alerted = {}           # subscription id -> monotonic time of the last alert
+held_back = set()           # subscription ids whose crossing is waiting out the cooldown
+last_values = {}            # (cell, field) -> last seen value, for subscribed cells only
+alert_queues = {}           # subscription id -> pending alerts
+subscriptions_lock = threading.Lock()
+webhook_queue = queue.Queue(maxsize=ALERT_QUEUE_SIZE)
+webhook_workers = []
+webhook_workers_lock = threading.Lock()
+refresher = None
+refresher_lock = threading.Lock()
+refresher_wakeup = threading.Event()
+pending_cells = set()       # newly subscribed cells awaiting their first refresh
+
+
+def get_cell(location):
+    """Normalize a location into the cell key used by the subscription index"""
+    return ' '.join(location.split()).lower()
+
+
+def get_subscription_values(conditions):
+    """
+    Flatten measured conditions and activity scores into the fields a rule can watch.
+    Activity scores are recomputed with ESTIMATED_INPUT_VALUES in place of the
+    estimated inputs, so they may differ from the scores shown in the app.
+    """
+    measured = set(conditions.get('measuredFields', []))
+    values = {field: conditions[field] for field in SUBSCRIPTION_FIELDS if field in measured}
+    if all(field in measured for field in ACTIVITY_MEASURED_INPUTS):
+        for activity in evaluate_activities(dict(conditions, **ESTIMATED_INPUT_VALUES)):
+            values[activity['key']] = activity['score']
+    return values
+
+
+def check_subscription(subscription, value):
+    """Return whether a subscription's rule holds for the given value"""
+    compare = SUBSCRIPTION_OPERATORS[subscription['operator']]
+    return compare(value, subscription['threshold'])
+
+
+def build_alert(subscription, value):
+    """Build the alert payload emitted when a subscription's threshold is crossed"""
+    return {
+        'id': uuid.uuid4().hex,
+        'subscriptionId': subscription['id'],
+        'location': subscription['location'],
+        'field': subscription['field'],
+        'operator': subscription['operator'],
+        'threshold': subscription['threshold'],
+        'value': value,
+        'triggeredAt': datetime.now().isoformat()
+    }
+
+
+def resolve_webhook_address(url):
+    """
+    Return the address to deliver a webhook to, or None if the URL is not allowed.
+    The URL must be http(s) and, unless private targets are allowed, every address
+    its host resolves to must be public.
+    """
+    if not isinstance(url, str):
+        return None
+    parsed = urlparse(url)
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    except ValueError:
+        return None
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return None
+    try:
+        addresses = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        return None
+    ips = [ipaddress.ip_address(address[4][0].split('%')[0]) for address in addresses]
+    if not ips:
+        return None
+    if not ALERT_WEBHOOK_ALLOW_PRIVATE and not all(ip.is_global for ip in ips):
+        return None
+    return str(ips[0])
+
+
+def is_valid_webhook_url(url):
+    """Check that a webhook URL is allowed (see resolve_webhook_address)"""
+    return resolve_webhook_address(url) is not None
+
+
+class PinnedHostAdapter(HTTPAdapter):
+    """Transport adapter that checks TLS against a hostname while connecting to a fixed IP"""
+
+    def __init__(self, hostname, **kwargs):
+        self.hostname = hostname
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['server_hostname'] = self.hostname
+        kwargs['assert_hostname'] = self.hostname
+        super().init_poolmanager(*args, **kwargs)
+
+
+def send_webhook(url, alert):
+    """
+    POST an alert to a subscription's webhook URL.
+    The host is resolved and checked again here, and the request is sent to the
+    checked address without following redirects, so neither a redirect nor a
+    DNS change between check and connect can reach a private address.
+    """
+    address = resolve_webhook_address(url)
+    if address is None:
+        print(f"Alert webhook skipped, URL not allowed: {url}")
+        return
+    parsed = urlparse(url)
+    userinfo, _, host = parsed.netloc.rpartition('@')
+    pinned_host = f"[{address}]" if ':' in address else address
+    if parsed.port:
+        pinned_host += f":{parsed.port}"
+    pinned_url = parsed._replace(netloc=f"{userinfo}@{pinned_host}" if userinfo else pinned_host).geturl()
+    try:
+        with requests.Session() as session:
+            if parsed.scheme == 'https':
+                session.mount('https://', PinnedHostAdapter(parsed.hostname))
+            session.post(pinned_url, json=alert, headers={'Host': host}, timeout=5, allow_redirects=False)
+    except Exception as e:
+        print(f"Alert webhook error ({url}): {e}")
+
+
+def run_webhook_worker():
+    """Send queued webhook alerts one at a time"""
+    while True:
+        url, alert = webhook_queue.get()
+        send_webhook(url, alert)
+        webhook_queue.task_done()
+
+
+def start_webhook_workers():
+    """Start the fixed pool of webhook worker threads on first use"""
+    with webhook_workers_lock:
+        while len(webhook_workers) < ALERT_WEBHOOK_WORKERS:
+            worker = threading.Thread(target=run_webhook_worker, daemon=True)
+            worker.start()
+            webhook_workers.append(worker)
+
+
+def deliver_alerts(alerts):
+    """Queue alerts on their subscription and hand any webhook sinks to the worker pool"""
+    for subscription, alert in alerts:
+        with subscriptions_lock:
+            pending = alert_queues.get(subscription['id'])
+            if pending is not None:
+                pending.append(alert)
+        if subscription.get('webhookUrl'):
+            start_webhook_workers()
+            try:
+                webhook_queue.put_nowait((subscription['webhookUrl'], alert))
+            except queue.Full:
+                print(f"Alert webhook queue full, dropping alert {alert['id']}")
+
+
+def evaluate_subscription(subscription, value, alerts):
+    """
+    Re-check one subscription and record an alert only on a threshold crossing.
+    A crossing within ALERT_COOLDOWN seconds of the previous alert is held back
+    and re-checked on the next update instead of alerting again.
+    """
+    subscription_id = subscription['id']
+    if not check_subscription(subscription, value):
+        subscription_state[subscription_id] = False
+        held_back.discard(subscription_id)
+        return
+    if subscription_state.get(subscription_id):
+        return
+    now = time.monotonic()
+    if subscription_id in last_alerted and now - last_alerted[subscription_id] < ALERT_COOLDOWN:
+        held_back.add(subscription_id)
+        return
+    alerts.append((subscription, build_alert(subscription, value)))
+    subscription_state[subscription_id] = True
+    last_alerted[subscription_id] = now
+    held_back.discard(subscription_id)
+
+
+def process_conditions_update(location, conditions):
+    """
+    Re-evaluate subscriptions for a location after fresh conditions land.
+    Only fields whose value changed since the last update are looked up in the
+    index, so cost scales with changes rather than with subscribers. Crossings
+    held back by the cooldown are re-checked even when the value is unchanged.
+    """
+    cell = get_cell(location)
+    alerts = []
+    with subscriptions_lock:
+        if cell not in cell_subscriptions:
+            return []
+        for field, value in get_subscription_values(conditions).items():
+            key = (cell, field)
+            subscription_ids = subscription_index.get(key, set())
+            if last_values.get(key) == value:
+                subscription_ids = subscription_ids & held_back
+            last_values[key] = value
+            for subscription_id in subscription_ids:
+                evaluate_subscription(subscriptions[subscription_id], value, alerts)
+    deliver_alerts(alerts)
+    return [alert for _, alert in alerts]
+
+
+def refresh_subscribed_cells(cells=None):
+    """Fetch conditions once per subscribed cell (or only the given cells) and feed them to the alert engine"""
+    with subscriptions_lock:
+        locations = [
+            subscriptions[next(iter(ids))]['location']
+            for cell, ids in cell_subscriptions.items()
+            if cells is None or cell in cells
+        ]
+    for location in locations:
+        try:
+            process_conditions_update(location, get_ocean_conditions(location))
+        except Exception as e:
+            print(f"Subscription refresh error ({location}): {e}")
+
+
+def run_refresher():
+    """
+    Refresh all subscribed cells every SUBSCRIPTION_REFRESH_INTERVAL seconds.
+    Newly subscribed cells wake the refresher early and are fetched on their own.
+    """
+    next_full_refresh = 0
+    while True:
+        if time.monotonic() >= next_full_refresh:
+            with subscriptions_lock:
+                pending_cells.clear()
+            refresh_subscribed_cells()
+            next_full_refresh = time.monotonic() + SUBSCRIPTION_REFRESH_INTERVAL
+        else:
+            with subscriptions_lock:
+                cells = set(pending_cells)
+                pending_cells.clear()
+            refresh_subscribed_cells(cells)
+        refresher_wakeup.wait(max(0, next_full_refresh - time.monotonic()))
+        refresher_wakeup.clear()
+
+
+def start_refresher():
+    """Start the background refresher on first use, unless disabled"""
+    global refresher
+    if SUBSCRIPTION_REFRESH_INTERVAL <= 0:
+        return
+    with refresher_lock:
+        if refresher is None:
+            refresher = threading.Thread(target=run_refresher, daemon=True)
+            refresher.start()
+
+
+def add_subscriptions(locations, field, op, threshold, webhook_url=None):
+    """
+    Register one subscription per location and check each against the last known
+    value, if any. All subscriptions created together share one secret token.
+    Returns None without registering anything when the request would exceed
+    MAX_SUBSCRIPTIONS or MAX_SUBSCRIBED_CELLS.
+    """
+    token = secrets.token_urlsafe(32)
+    created = []
+    alerts = []
+    with subscriptions_lock:
+        new_cells = {get_cell(location) for location in locations} - set(cell_subscriptions)
+        if (len(subscriptions) + len(locations) > MAX_SUBSCRIPTIONS
+                or len(cell_subscriptions) + len(new_cells) > MAX_SUBSCRIBED_CELLS):
+            return None
+        for location in locations:
+            subscription = {
+                'id': uuid.uuid4().hex,
+                'location': location,
+                'field': field,
+                'operator': op,
+                'threshold': threshold,
+                'webhookUrl': webhook_url,
+                'token': token,
+                'createdAt': datetime.now().isoformat()
+            }
+            cell = get_cell(location)
+            key = (cell, field)
+            subscriptions[subscription['id']] = subscription
+            alert_queues[subscription['id']] = deque(maxlen=ALERT_QUEUE_SIZE)
+            subscription_index.setdefault(key, set()).add(subscription['id'])
+            if cell not in cell_subscriptions:
+                pending_cells.add(cell)
+                refresher_wakeup.set()
+            cell_subscriptions.setdefault(cell, set()).add(subscription['id'])
+            if key in last_values:
+                evaluate_subscription(subscription, last_values[key], alerts)
+            created.append(subscription)
+    deliver_alerts(alerts)
+    start_refresher()
+    return created
+
+
+def get_owned_subscription(subscription_id, token):
+    """Return a subscription only if the caller holds its secret token"""
+    subscription = subscriptions.get(subscription_id)
+    if not subscription or not isinstance(token, str):
+        return None
+    if not hmac.compare_digest(subscription['token'], token):
+        return None
+    return subscription
+
+
+def public_subscription(subscription):
+    """Subscription fields safe to return to its owner (everything but the token)"""
+    return {key: value for key, value in subscription.items() if key != 'token'}
+
+
+def remove_subscription(subscription_id):
+    """Remove a subscription, drop it from the index and forget values for cells nobody watches"""
+    with subscriptions_lock:
+        subscription = subscriptions.pop(subscription_id, None)
+        if not subscription:
+            return None
+        subscription_state.pop(subscription_id, None)
+        last_alerted.pop(subscription_id, None)
+        held_back.discard(subscription_id)
+        alert_queues.pop(subscription_id, None)
+        cell = get_cell(subscription['location'])
+        key = (cell, subscription['field'])
+        ids = subscription_index.get(key)
+        if ids:
+            ids.discard(subscription_id)
+            if not ids:
+                del subscription_index[key]
+        ids = cell_subscriptions.get(cell)
+        if ids:
+            ids.discard(subscription_id)
+            if not ids:
+                del cell_subscriptions[cell]
+                for value_key in [k for k in last_values if k[0] == cell]:
+                    del last_values[value_key]
+    return subscription
+
+
 @app.route('/')
 def index():
     """Serve the main HTML page"""
@@ -647,6 +1068,12 @@ def get_conditions():
         # Evaluate activities
         activities = evaluate_activities(conditions)
         
+        # Re-check subscriptions watching this location
+        try:
+            process_conditions_update(location, conditions)
+        except Exception as e:
+            print(f"Subscription alert error: {e}")
+        
         return jsonify({
             'success': True,
             'conditions': conditions,
@@ -659,6 +1086,82 @@ def get_conditions():
         }), 500
 
 
+@app.route('/api/subscriptions/<subscription_id>', methods=['GET'])
+def get_subscription(subscription_id):
+    """API endpoint to fetch one alert subscription (requires its token)"""
+    with subscriptions_lock:
+        subscription = get_owned_subscription(subscription_id, request.headers.get('X-Subscription-Token'))
+        if not subscription:
+            return jsonify({'success': False, 'error': 'Subscription not found'}), 404
+        item = public_subscription(subscription)
+    return jsonify({'success': True, 'subscription': item})
+
+
+@app.route('/api/subscriptions', methods=['POST'])
+def create_subscription():
+    """
+    API endpoint to subscribe to threshold alerts.
+    Accepts either a single 'location' or a list of 'locations' (e.g. all saved spots).
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Request body must be a JSON object'}), 400
+    locations = data.get('locations') or [data.get('location')]
+    field = data.get('field')
+    op = data.get('operator', '>=')
+    threshold = data.get('threshold')
+    webhook_url = data.get('webhookUrl')
+    
+    if not isinstance(locations, list) or not all(isinstance(loc, str) and loc.strip() for loc in locations):
+        return jsonify({'success': False, 'error': 'location is required'}), 400
+    if len(locations) > MAX_LOCATIONS_PER_SUBSCRIPTION:
+        return jsonify({'success': False, 'error': f'At most {MAX_LOCATIONS_PER_SUBSCRIPTION} locations per request'}), 400
+    if not isinstance(field, str) or (field not in SUBSCRIPTION_FIELDS and field not in ACTIVITIES):
+        return jsonify({'success': False, 'error': f'Unsupported field: {field}'}), 400
+    if not isinstance(op, str) or op not in SUBSCRIPTION_OPERATORS:
+        return jsonify({'success': False, 'error': f'Unsupported operator: {op}'}), 400
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not math.isfinite(threshold):
+        return jsonify({'success': False, 'error': 'threshold must be a number'}), 400
+    
+    if webhook_url is not None and not is_valid_webhook_url(webhook_url):
+        return jsonify({'success': False, 'error': 'webhookUrl must be a public http(s) URL'}), 400
+    
+    created = add_subscriptions([loc.strip() for loc in locations], field, op, threshold, webhook_url)
+    if created is None:
+        return jsonify({'success': False, 'error': 'Subscription limit reached'}), 429
+    return jsonify({
+        'success': True,
+        'token': created[0]['token'],
+        'subscriptions': [public_subscription(subscription) for subscription in created]
+    }), 201
+
+
+@app.route('/api/subscriptions/<subscription_id>', methods=['DELETE'])
+def delete_subscription(subscription_id):
+    """API endpoint to remove an alert subscription (requires its token)"""
+    with subscriptions_lock:
+        owned = get_owned_subscription(subscription_id, request.headers.get('X-Subscription-Token'))
+    if not owned or not remove_subscription(subscription_id):
+        return jsonify({'success': False, 'error': 'Subscription not found'}), 404
+    return jsonify({'success': True})
+
+
+@app.route('/api/alerts', methods=['GET'])
+def get_alerts():
+    """API endpoint to drain pending alerts for one subscription (requires its token)"""
+    subscription_id = request.args.get('subscriptionId', '')
+    if not subscription_id:
+        return jsonify({'success': False, 'error': 'subscriptionId is required'}), 400
+    
+    with subscriptions_lock:
+        if not get_owned_subscription(subscription_id, request.headers.get('X-Subscription-Token')):
+            return jsonify({'success': False, 'error': 'Subscription not found'}), 404
+        pending = alert_queues[subscription_id]
+        alerts = list(pending)
+        pending.clear()
+    return jsonify({'success': True, 'alerts': alerts})
+
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as ocean_app  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def reset_subscriptions(monkeypatch):
+    """Start every test with an empty subscription store and no background threads"""
+    monkeypatch.setattr(ocean_app, 'SUBSCRIPTION_REFRESH_INTERVAL', 0)
+    monkeypatch.setattr(ocean_app, 'ALERT_COOLDOWN', 0)
+    for state in (
+        ocean_app.subscriptions, ocean_app.subscription_index, ocean_app.cell_subscriptions,
+        ocean_app.subscription_state, ocean_app.last_alerted, ocean_app.held_back,
+        ocean_app.last_values, ocean_app.alert_queues, ocean_app.pending_cells
+    ):
+        state.clear()
+    yield
+
+
+@pytest.fixture
+def client():
+    return ocean_app.app.test_client()
@@ -0,0 +1,217 @@
+import math
+
+import pytest
+
+import app as ocean_app
+
+MEASURED_CONDITIONS = {
+    'temperature': 72,
+    'windSpeed': 5,
+    'windDirection': 'W',
+    'cloudValue': 10,
+    'pressureValue': 30.1,
+    'hasPrecipitation': False,
+    'waterTemperature': 74,
+    'waveHeight': 1,
+    'swellDirection': 'W',
+    'currentValue': 0.5,
+    'visibility': 50,
+    'uvIndex': 3,
+    'tideValue': 0.5,
+    'measuredFields': list(ocean_app.ACTIVITY_MEASURED_INPUTS)
+}
+
+
+def subscribe(client, **body):
+    body.setdefault('location', 'Pacific Beach')
+    body.setdefault('field', 'waveHeight')
+    body.setdefault('operator', '>')
+    body.setdefault('threshold', 3)
+    response = client.post('/api/subscriptions', json=body)
+    assert response.status_code == 201
+    return response.json['token'], response.json['subscriptions']
+
+
+def update(location, **fields):
+    conditions = dict(MEASURED_CONDITIONS, **fields)
+    return ocean_app.process_conditions_update(location, conditions)
+
+
+def drain(client, token, subscription_id):
+    response = client.get(
+        f'/api/alerts?subscriptionId={subscription_id}',
+        headers={'X-Subscription-Token': token}
+    )
+    assert response.status_code == 200
+    return response.json['alerts']
+
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    'waveHeight',
+    {'field': 'waveHeight', 'threshold': 1},
+    {'location': 'x', 'field': ['waveHeight'], 'threshold': 1},
+    {'location': 'x', 'field': 'waveHeight', 'operator': {}, 'threshold': 1},
+    {'location': 'x', 'field': 'uvIndex', 'threshold': 1},
+    {'location': 'x', 'field': 'tideValue', 'threshold': 1},
+    {'location': 'x', 'field': 'waveHeight', 'operator': '==', 'threshold': 1},
+    {'location': 'x', 'field': 'waveHeight', 'threshold': True},
+    {'location': 'x', 'field': 'waveHeight', 'threshold': math.nan},
+    {'location': 'x', 'field': 'waveHeight', 'threshold': math.inf},
+    {'location': 'x', 'field': 'waveHeight', 'threshold': 1, 'webhookUrl': 123},
+    {'location': 'x', 'field': 'waveHeight', 'threshold': 1, 'webhookUrl': 'ftp://example.com'},
+    {'location': 'x', 'field': 'waveHeight', 'threshold': 1, 'webhookUrl': 'http://127.0.0.1/hook'},
+    {'location': 'x', 'field': 'waveHeight', 'threshold': 1, 'webhookUrl': 'http://169.254.169.254/'},
+])
+def test_create_rejects_invalid_body(client, body):
+    response = client.post('/api/subscriptions', json=body)
+    assert response.status_code == 400
+    assert response.json['success'] is False
+    assert not ocean_app.subscriptions
+
+
+def test_create_limits(client, monkeypatch):
+    monkeypatch.setattr(ocean_app, 'MAX_SUBSCRIBED_CELLS', 2)
+    too_many = [str(i) for i in range(ocean_app.MAX_LOCATIONS_PER_SUBSCRIPTION + 1)]
+    response = client.post('/api/subscriptions', json={'locations': too_many, 'field': 'waveHeight', 'threshold': 1})
+    assert response.status_code == 400
+
+    subscribe(client, locations=['A', 'B'])
+    response = client.post('/api/subscriptions', json={'locations': ['a', 'C'], 'field': 'swimming', 'threshold': 70})
+    assert response.status_code == 429
+    assert len(ocean_app.subscriptions) == 2
+    # Existing cells do not count against the cell limit
+    subscribe(client, locations=['a', ' b '], field='swimming')
+
+
+def test_token_required(client):
+    token, [subscription] = subscribe(client)
+    assert 'token' not in subscription
+    path = f"/api/subscriptions/{subscription['id']}"
+    alerts_path = f"/api/alerts?subscriptionId={subscription['id']}"
+
+    assert client.get('/api/subscriptions').status_code == 405
+    for headers in ({}, {'X-Subscription-Token': 'wrong'}):
+        assert client.get(path, headers=headers).status_code == 404
+        assert client.get(alerts_path, headers=headers).status_code == 404
+        assert client.delete(path, headers=headers).status_code == 404
+
+    owner = {'X-Subscription-Token': token}
+    assert client.get(path, headers=owner).json['subscription']['field'] == 'waveHeight'
+    assert client.delete(path, headers=owner).status_code == 200
+    assert client.delete(path, headers=owner).status_code == 404
+
+
+def test_alerts_only_on_crossing(client):
+    token, [subscription] = subscribe(client)
+    assert len(update('pacific beach', waveHeight=5)) == 1
+    assert update('Pacific  Beach', waveHeight=6) == []
+    assert update('Pacific Beach', waveHeight=2) == []
+    assert len(update('Pacific Beach', waveHeight=4)) == 1
+
+    alerts = drain(client, token, subscription['id'])
+    assert [alert['value'] for alert in alerts] == [5, 4]
+    assert drain(client, token, subscription['id']) == []
+
+
+def test_alert_queues_are_per_subscription(client):
+    low_token, [low] = subscribe(client, threshold=3)
+    high_token, [high] = subscribe(client, threshold=8)
+    update('Pacific Beach', waveHeight=5)
+    assert len(drain(client, low_token, low['id'])) == 1
+    assert drain(client, high_token, high['id']) == []
+
+
+def test_new_subscription_checks_last_value(client):
+    subscribe(client, threshold=10)
+    update('Pacific Beach', waveHeight=5)
+    token, [subscription] = subscribe(client, threshold=3)
+    assert len(drain(client, token, subscription['id'])) == 1
+
+
+def test_cooldown_holds_back_and_releases(client, monkeypatch):
+    monkeypatch.setattr(ocean_app, 'ALERT_COOLDOWN', 100)
+    token, [subscription] = subscribe(client)
+    assert len(update('Pacific Beach', waveHeight=5)) == 1
+    update('Pacific Beach', waveHeight=1)
+    assert update('Pacific Beach', waveHeight=5) == []
+    assert subscription['id'] in ocean_app.held_back
+
+    # Once the cooldown has passed, the held-back crossing fires on an unchanged value
+    ocean_app.last_alerted[subscription['id']] -= 200
+    assert len(update('Pacific Beach', waveHeight=5)) == 1
+    assert subscription['id'] not in ocean_app.held_back
+    assert len(drain(client, token, subscription['id'])) == 2
+
+
+def test_index_scoping_and_cleanup(client):
+    token, [subscription] = subscribe(client)
+    update('Somewhere Else', waveHeight=5)
+    assert not any(cell == 'somewhere else' for cell, _ in ocean_app.last_values)
+
+    update('Pacific Beach', waveHeight=1)
+    assert ocean_app.last_values[('pacific beach', 'waveHeight')] == 1
+
+    client.delete(f"/api/subscriptions/{subscription['id']}", headers={'X-Subscription-Token': token})
+    assert ocean_app.last_values == {}
+    assert ocean_app.subscription_index == {}
+    assert ocean_app.cell_subscriptions == {}
+
+
+def test_unmeasured_fields_are_ignored(client):
+    subscribe(client)
+    assert update('Pacific Beach', waveHeight=5, measuredFields=[]) == []
+    simulated = ocean_app.get_simulated_conditions('Pacific Beach')
+    assert ocean_app.process_conditions_update('Pacific Beach', simulated) == []
+
+
+def test_activity_score_ignores_estimated_inputs():
+    scores = set()
+    for visibility, uv_index, tide in [(0, 0, 0), (80, 11, -2), (45, 6, 0.5), (25, 9, 1.9)]:
+        conditions = dict(MEASURED_CONDITIONS, visibility=visibility, uvIndex=uv_index, tideValue=tide)
+        scores.add(ocean_app.get_subscription_values(conditions)['swimming'])
+    assert len(scores) == 1
+
+    partial = dict(MEASURED_CONDITIONS, measuredFields=['waveHeight'])
+    assert ocean_app.get_subscription_values(partial) == {'waveHeight': 1}
+
+
+def test_conditions_survive_alert_errors(client, monkeypatch):
+    def fail(*args):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(ocean_app, 'get_ocean_conditions', ocean_app.get_simulated_conditions)
+    monkeypatch.setattr(ocean_app, 'process_conditions_update', fail)
+    response = client.get('/api/conditions?location=Pacific%20Beach')
+    assert response.status_code == 200
+    assert response.json['success'] is True
+
+
+def test_webhook_is_pinned_and_not_redirected(monkeypatch):
+    sent = []
+
+    def fake_getaddrinfo(host, port, *args, **kwargs):
+        return [(None, None, None, '', ('93.184.216.34', port))]
+
+    def fake_post(self, url, **kwargs):
+        sent.append((url, kwargs))
+
+    monkeypatch.setattr(ocean_app.socket, 'getaddrinfo', fake_getaddrinfo)
+    monkeypatch.setattr(ocean_app.requests.Session, 'post', fake_post)
+    ocean_app.send_webhook('https://hooks.example.com:8443/alert?key=1', {'id': 'a'})
+
+    [(url, kwargs)] = sent
+    assert url == 'https://93.184.216.34:8443/alert?key=1'
+    assert kwargs['headers'] == {'Host': 'hooks.example.com:8443'}
+    assert kwargs['allow_redirects'] is False
+
+
+def test_webhook_skips_private_address(monkeypatch):
+    sent = []
+    monkeypatch.setattr(
+        ocean_app.socket, 'getaddrinfo',
+        lambda host, port, *args, **kwargs: [(None, None, None, '', ('10.0.0.5', port))]
+    )
+    monkeypatch.setattr(ocean_app.requests.Session, 'post', lambda self, url, **kwargs: sent.append(url))
+    ocean_app.send_webhook('https://hooks.example.com/alert', {'id': 'a'})
+    assert sent == []